@@ -1,44 +1,459 @@
 import os
-import datetime
+import asyncio
+import hashlib
 import traceback
 import logging
+import queue
 import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; the health payload omits RSS there.
+    resource = None
+from logging.handlers import QueueHandler, QueueListener
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from typing import List, Optional
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field
+import httpx
 import motor.motor_asyncio
+from pymongo import WriteConcern
+from pymongo.errors import CollectionInvalid, PyMongoError
 import uvicorn
 
+# Install uvloop as the asyncio event loop policy so programmatic
+# asyncio.run paths (scripts, tests) get the fast loop too, not just
+# servers launched with loop="uvloop".
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # --- Logging Configuration ---
+# Request-path handlers only enqueue records (QueueHandler.prepare bakes
+# the bare message in on the calling thread); the QueueListener thread
+# renders the final line and does the blocking stdout write, so log I/O
+# never blocks the event loop.
+_log_record_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(logging.Formatter(
+    "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+))
+
 logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[logging.StreamHandler(sys.stdout)]
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    # Message-only on the queue side: without this, basicConfig's default
+    # "%(levelname)s:%(name)s:%(message)s" gets baked into record.msg and
+    # the listener-side formatter prefixes every line a second time.
+    format="%(message)s",
+    handlers=[QueueHandler(_log_record_queue)]
 )
+
+_log_listener = QueueListener(_log_record_queue, _stream_handler)
+_log_listener.start()
+
 logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 MONGO_URI = os.getenv("MONGO_URI")
+UTC = timezone.utc
+DEBUG = os.getenv("DEBUG") == "1"
+
+MAX_POOL_SIZE = 20
+MIN_POOL_SIZE = 5
+
+# The background probe pings MongoDB on this interval; / serves the
+# cached snapshot so health polls never touch the database directly.
+_HEALTH_INTERVAL = 10.0
+_HEALTH_PING_TIMEOUT = 2.0
+
+_health = {
+    "ok": False,
+    "ping_ms": None,
+    "checked_at": None,
+    "error": None,
+}
+
+# Invariant-after-startup portion of the health payload, merged into the
+# per-request diagnostics instead of being rebuilt on every poll.
+_HEALTH_STATIC = {
+    "mongo_uri_set": bool(MONGO_URI),
+}
+
+_process_start = time.monotonic()
+
+# Module-global client so warm serverless containers reuse the connection
+# pool across invocations instead of paying TCP+TLS+auth on every request.
+_client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+_client_pid: Optional[int] = None
 
 def get_mongo_client():
     """
-    Create a NEW MongoDB client for each request.
+    Return the shared MongoDB client, creating it on first use.
+
+    The client is instantiated lazily (on the first request, inside the
+    running event loop) rather than at import time, to avoid binding it
+    to a loop that is later closed. Memoized per PID: a client inherited
+    across a fork (gunicorn --preload, multiprocessing) holds sockets
+    belonging to the parent and must not be reused.
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid != os.getpid():
+        _client = None
+    if _client is None:
+        _client_pid = os.getpid()
+        logger.info("🔄 Creating shared MongoDB client...")
+        _client = motor.motor_asyncio.AsyncIOMotorClient(
+            MONGO_URI,
+            serverSelectionTimeoutMS=5000,
+            connectTimeoutMS=10000,
+            socketTimeoutMS=10000,
+            maxPoolSize=MAX_POOL_SIZE,
+            minPoolSize=MIN_POOL_SIZE,
+            maxIdleTimeMS=60_000,
+            waitQueueTimeoutMS=2000,
+            retryWrites=True,
+            compressors="zstd,snappy,zlib",
+            zlibCompressionLevel=6
+        )
+        logger.info("✅ MongoDB client created")
+    return _client
+
+def get_log_collection():
+    """
+    Return the rag_logs collection with w=0 (unacknowledged) writes.
+
+    Log entries are telemetry: the flusher sends the batch and moves on
+    without waiting for any server acknowledgment, so a flush costs a
+    local socket send rather than a server round trip. Anything that
+    needs durability should get its own collection handle with the
+    default concern.
+    """
+    return get_mongo_client().event.get_collection(
+        "rag_logs", write_concern=WriteConcern(w=0)
+    )
+
+# --- Response Cache ---
+# Layer 1 is an in-process LRU; layer 2 is the rag_cache collection,
+# bounded by a TTL index created at startup. Identical (query, top_k)
+# requests skip generation entirely on a hit.
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 3600  # seconds
+
+# A layer-2 lookup that cannot beat generation by a wide margin is not
+# worth waiting for; past this bound it is treated as a miss.
+_CACHE_LOOKUP_TIMEOUT = 0.1  # seconds
+
+_response_cache: OrderedDict = OrderedDict()
+
+def _cache_key(query: str, top_k: int) -> str:
+    return hashlib.blake2b(
+        f"{top_k}:{query}".encode(), digest_size=16
+    ).hexdigest()
+
+def _cache_get(key: str):
+    response = _response_cache.get(key)
+    if response is not None:
+        _response_cache.move_to_end(key)
+    return response
+
+def _cache_put(key: str, response: dict):
+    _response_cache[key] = response
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+def get_cache_collection():
+    """
+    Return the rag_cache collection (layer-2 response cache).
+    """
+    return get_mongo_client().event.rag_cache
+
+def get_contexts_collection():
+    """
+    Return the rag_contexts collection (deduplicated context storage).
+    """
+    return get_mongo_client().event.rag_contexts
+
+def _contexts_hash(contexts: List[str]) -> bytes:
+    return hashlib.blake2b(
+        b"\x00".join(c.encode() for c in contexts), digest_size=16
+    ).digest()
+
+# Fire-and-forget writes (cache population etc.) are tracked here so
+# shutdown can wait for in-flight ones; the done callback keeps the set
+# from pinning finished tasks.
+_pending_writes: set = set()
+
+def _spawn_write(coro):
+    task = asyncio.create_task(coro)
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+async def _store_cached_response(key: str, response: dict, now: datetime):
+    try:
+        await get_cache_collection().update_one(
+            {"_id": key},
+            {"$set": {
+                "answer": response["answer"],
+                "contexts": response["contexts"],
+                "ts": now
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"❌ Failed to store cached response: {str(e)}")
+
+async def _store_contexts(ctx_hash: bytes, contexts: List[str]):
+    try:
+        # $setOnInsert: only the first sighting of this context set pays
+        # the write; repeats are a no-op upsert.
+        await get_contexts_collection().update_one(
+            {"_id": ctx_hash},
+            {"$setOnInsert": {"ctx": contexts}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"❌ Failed to store contexts: {str(e)}")
+
+async def _persist_response_artifacts(cache_key: str, response: dict,
+                                      ctx_hash: bytes, now: datetime):
+    """
+    Run the independent post-response writes concurrently.
+
+    The layer-2 cache upsert and the contexts dedup upsert have no
+    ordering dependency, so one task pays a single round-trip's latency
+    for both instead of two sequential RTTs.
+    """
+    await asyncio.gather(
+        _store_cached_response(cache_key, response, now),
+        _store_contexts(ctx_hash, response["contexts"]),
+        return_exceptions=True,
+    )
+
+# --- Background Log Flusher ---
+LOG_BATCH_SIZE = 256
+LOG_FLUSH_INTERVAL = 0.2  # seconds
+
+log_queue: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+_dropped_logs = 0
+
+# Fixed key order for success entries: BSON is order-sensitive, and a
+# constant document shape keeps the encoder on its fast path.
+_LOG_FIELDS = (
+    "timestamp",
+    "request_query",
+    "request_top_k",
+    "response_answer",
+    "contexts_hash",
+    "cached",
+    "status",
+)
+
+def _enqueue_log(entry):
+    """
+    Queue a log entry for the background flusher.
+
+    Drops the entry (with a counter) if the queue is full — request
+    latency is never sacrificed to preserve telemetry.
+    """
+    global _dropped_logs
+    try:
+        log_queue.put_nowait(entry)
+    except asyncio.QueueFull:
+        _dropped_logs += 1
+        logger.warning(f"⚠️ Log queue full; {_dropped_logs} entries dropped so far")
+
+async def _log_flusher():
+    """
+    Drain log entries from the queue and write them to MongoDB in batches.
+
+    Runs as a single background task so request handlers never wait on a
+    MongoDB round trip just to persist a log entry. Entries are collected
+    until the batch is full or the flush interval elapses, then written
+    with one insert_many.
+    """
+    logger.info("📦 Log flusher task started")
+    log_collection = get_log_collection()
+
+    while True:
+        try:
+            entry = await asyncio.wait_for(log_queue.get(), timeout=LOG_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            continue
+
+        batch = [entry]
+        while len(batch) < LOG_BATCH_SIZE and not log_queue.empty():
+            batch.append(log_queue.get_nowait())
+
+        try:
+            # ordered=False so one bad document does not stall the batch.
+            # No bypass_document_validation here: PyMongo rejects it on
+            # unacknowledged (w=0) writes, and rag_logs has no validator.
+            await log_collection.insert_many(batch, ordered=False)
+            logger.debug(f"💾 Flushed {len(batch)} log entries")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Failed to flush {len(batch)} log entries: {str(e)}")
+
+async def _drain_log_queue():
+    """
+    Flush any log entries still queued at shutdown.
+    """
+    if log_queue.empty():
+        return
+    batch = []
+    while not log_queue.empty():
+        batch.append(log_queue.get_nowait())
+    try:
+        await get_log_collection().insert_many(batch, ordered=False)
+        logger.info(f"💾 Drained {len(batch)} log entries at shutdown")
+    except Exception as e:
+        logger.error(f"❌ Failed to drain log queue: {str(e)}")
+
+async def _health_probe():
+    """
+    Ping MongoDB on a fixed interval and record the result in _health.
+
+    Keeps the health endpoint O(1): probes (Kubernetes, uptime monitors)
+    read the latest snapshot instead of each issuing an admin command —
+    and a slow or down MongoDB can no longer hang the probe for the full
+    server-selection timeout.
+    """
+    client = get_mongo_client()
+    while True:
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                client.admin.command('ping'), timeout=_HEALTH_PING_TIMEOUT
+            )
+            _health.update(
+                ok=True,
+                ping_ms=round((time.perf_counter() - t0) * 1000, 2),
+                checked_at=datetime.now(UTC).isoformat(),
+                error=None,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # str(e) alone is empty for TimeoutError — the common case
+            # when Mongo is slow — so include the exception type.
+            error_msg = f"{type(e).__name__}: {e}"
+            _health.update(
+                ok=False,
+                ping_ms=None,
+                checked_at=datetime.now(UTC).isoformat(),
+                error=error_msg,
+            )
+            logger.error(f"❌ Background health ping failed: {error_msg}")
+        await asyncio.sleep(_HEALTH_INTERVAL)
+
+async def _warm_connection_pool():
     """
-    logger.info("🔄 Creating fresh MongoDB client for this request...")
-    client = motor.motor_asyncio.AsyncIOMotorClient(
-        MONGO_URI,
-        serverSelectionTimeoutMS=5000,
-        connectTimeoutMS=10000,
-        socketTimeoutMS=10000,
-        maxPoolSize=1,
-        minPoolSize=0
+    Pre-open MIN_POOL_SIZE connections so the first user requests do not
+    pay TLS + SCRAM + topology discovery latency after a cold start.
+
+    Concurrent pings force the pool to open that many sockets at once;
+    Motor otherwise connects lazily on first use.
+    """
+    client = get_mongo_client()
+    await client.admin.command('ping')
+    await asyncio.gather(
+        *[client.admin.command('ping') for _ in range(MIN_POOL_SIZE)]
     )
-    logger.info("✅ MongoDB client created")
-    return client
+    logger.info(f"🔥 Connection pool warmed with {MIN_POOL_SIZE} connections")
+
+async def _ensure_log_collection():
+    """
+    Create rag_logs as a capped collection with a timestamp index.
+
+    Capping bounds disk/RAM growth and uses MongoDB's fast capped-insert
+    path. Idempotent: CollectionInvalid means it already exists. TTL
+    indexes are not supported on capped collections, so a plain
+    descending timestamp index covers recent-log queries instead.
+    """
+    db = get_mongo_client().event
+    try:
+        await db.create_collection("rag_logs", capped=True, size=1 << 30, max=1_000_000)
+        logger.info("✅ Created capped rag_logs collection")
+    except CollectionInvalid:
+        pass
+    await db.rag_logs.create_index([("timestamp", -1)])
+    await db.rag_logs.create_index([("status", 1), ("timestamp", -1)])
+
+async def _ensure_cache_collection():
+    """
+    Create the TTL index that expires layer-2 response cache entries.
+    """
+    await get_cache_collection().create_index(
+        "ts", expireAfterSeconds=RESPONSE_CACHE_TTL
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the background tasks and shared clients on startup; drain and
+    close them on shutdown.
+    """
+    # Shared HTTP client for the upstream LLM / vector DB calls the real
+    # RAG integration will make: keep-alive + HTTP/2 pooling means no
+    # per-request TLS handshake.
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=httpx.Timeout(10.0, connect=2.0)
+    )
+    if MONGO_URI:
+        try:
+            await _warm_connection_pool()
+        except Exception as e:
+            logger.error(f"❌ Failed to warm connection pool: {str(e)}")
+        try:
+            await _ensure_log_collection()
+        except Exception as e:
+            logger.error(f"❌ Failed to set up rag_logs collection: {str(e)}")
+        try:
+            await _ensure_cache_collection()
+        except Exception as e:
+            logger.error(f"❌ Failed to set up rag_cache collection: {str(e)}")
+    flusher_task = asyncio.create_task(_log_flusher())
+    health_task = asyncio.create_task(_health_probe()) if MONGO_URI else None
+    yield
+    if health_task:
+        health_task.cancel()
+    flusher_task.cancel()
+    for task in filter(None, (health_task, flusher_task)):
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if _pending_writes:
+        await asyncio.gather(*_pending_writes, return_exceptions=True)
+    await _drain_log_queue()
+    await app.state.http.aclose()
+    if _client is not None:
+        _client.close()
+        logger.debug("🔒 MongoDB client closed")
+
+# --- Placeholder RAG Templates ---
+# Pre-bound format methods so the hot path does a single call instead of
+# rebuilding f-string bytecode per request.
+_CTX1 = "Placeholder context 1 for query: '{q}'".format
+_CTX2 = "Placeholder context 2 (top_k was {k})".format
+_CTX3 = "Placeholder context 3: Always consult a medical professional."
+_ANSWER = "This is a placeholder answer for '{q}'.".format
 
 # --- Pydantic Models ---
 class QueryRequest(BaseModel):
@@ -53,32 +468,64 @@ class QueryResponse(BaseModel):
 app = FastAPI(
     title="RAG Medical Query API",
     description="An API to get answers and contexts for medical questions.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Compress large responses (real RAG contexts can be tens of KB of JSON);
+# small payloads below the threshold are sent as-is.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # --- Global Exception Handler ---
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """
     Catch ALL unhandled exceptions and return detailed error info.
     """
+    exc_type = type(exc).__name__
+    exc_msg = str(exc)
+
     error_detail = {
         "error": "Internal Server Error",
-        "type": type(exc).__name__,
-        "message": str(exc),
-        "traceback": traceback.format_exc(),
+        "type": exc_type,
+        "message": exc_msg,
         "path": str(request.url),
         "method": request.method
     }
+
+    logger.exception(f"❌ UNHANDLED EXCEPTION: {exc_type}: {exc_msg}")
     
-    logger.error(f"❌ UNHANDLED EXCEPTION: {type(exc).__name__}: {str(exc)}")
-    logger.error(f"Traceback:\n{traceback.format_exc()}")
-    
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content=error_detail
     )
 
+# --- MongoDB Error Handler ---
+@app.exception_handler(PyMongoError)
+async def pymongo_exception_handler(request: Request, exc: PyMongoError):
+    """
+    Handle driver failures cheaply: no traceback formatting, repr only.
+    """
+    exc_type = type(exc).__name__
+    logger.error(f"❌ MongoDB error on {request.url.path}: {repr(exc)}")
+
+    _enqueue_log({
+        "timestamp": datetime.now(UTC),
+        "path": request.url.path,
+        "error_message": str(exc),
+        "error_type": exc_type,
+        "status": "error"
+    })
+
+    return ORJSONResponse(
+        status_code=503,
+        content={
+            "error": "Database Error",
+            "type": exc_type
+        }
+    )
+
 # --- Validation Error Handler ---
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -94,7 +541,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     
     logger.warning(f"❌ VALIDATION ERROR: {exc.errors()}")
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content=error_detail
     )
@@ -104,57 +551,53 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 @app.get("/")
 async def health_check():
     """
-    Comprehensive health check endpoint with detailed diagnostics.
+    Health check endpoint serving the cached background-probe snapshot.
     """
     diagnostics = {
-        "status": "unknown",
-        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-        "mongo_uri_set": bool(MONGO_URI),
-        "mongo_uri_preview": MONGO_URI[:30] + "..." if MONGO_URI else None,
+        **_HEALTH_STATIC,
+        "timestamp": datetime.now(UTC).isoformat(),
+        "uptime_sec": round(time.monotonic() - _process_start, 1),
     }
-    
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is kilobytes on Linux but bytes on macOS.
+        if sys.platform == "darwin":
+            max_rss //= 1024
+        diagnostics["max_rss_kb"] = max_rss
+
     if not MONGO_URI:
         diagnostics["status"] = "error"
         diagnostics["error"] = "MONGO_URI not set"
         logger.error("❌ Health check failed: MONGO_URI not set")
-        return JSONResponse(status_code=503, content=diagnostics)
-    
-    client = None
-    try:
-        logger.info("🏥 Running health check...")
-        client = get_mongo_client()
-        
-        # Try to ping MongoDB
-        await client.admin.command('ping')
-        
+        return ORJSONResponse(status_code=503, content=diagnostics)
+
+    # Serve the snapshot maintained by the background probe; no MongoDB
+    # round trip happens on the request path.
+    diagnostics["ping_ms"] = _health["ping_ms"]
+    diagnostics["checked_at"] = _health["checked_at"]
+
+    if _health["ok"]:
         diagnostics["status"] = "ok"
         diagnostics["message"] = "MongoDB connection successful"
-        logger.info("✅ Health check passed")
-        return JSONResponse(status_code=200, content=diagnostics)
-        
-    except Exception as e:
-        diagnostics["status"] = "error"
-        diagnostics["error"] = str(e)
-        diagnostics["error_type"] = type(e).__name__
-        diagnostics["traceback"] = traceback.format_exc()
-        logger.error(f"❌ Health check failed: {str(e)}")
-        logger.debug(traceback.format_exc())
-        return JSONResponse(status_code=503, content=diagnostics)
-    
-    finally:
-        if client:
-            client.close()
-            logger.debug("🔒 MongoDB client closed")
+        return diagnostics
 
-@app.post("/query")
+    diagnostics["status"] = "error"
+    if _health["checked_at"] is None:
+        diagnostics["error"] = "MongoDB not yet probed"
+    else:
+        diagnostics["error"] = _health["error"]
+    return ORJSONResponse(status_code=503, content=diagnostics)
+
+@app.post("/query", responses={200: {"model": QueryResponse}})
 async def get_rag_response(query_request: QueryRequest):
     """
     Accepts a medical query and returns a generated answer with logging.
     """
-    logger.info(f"📝 Received query: '{query_request.query}' with top_k={query_request.top_k}")
+    logger.debug("📝 Received query: '%s' with top_k=%d",
+                 query_request.query, query_request.top_k)
 
     if not MONGO_URI:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=503,
             content={
                 "error": "Service Unavailable",
@@ -162,102 +605,169 @@ async def get_rag_response(query_request: QueryRequest):
             }
         )
 
-    client = None
+    now = datetime.now(UTC)
+    cache_key = _cache_key(query_request.query, query_request.top_k)
+
     try:
-        # Create fresh client for this request
-        client = get_mongo_client()
-        db = client.event
-        log_collection = db.rag_logs
-        
-        logger.info("🔍 Processing query...")
-        
-        # --- RAG Model Integration ---
-        placeholder_contexts = [
-            f"Placeholder context 1 for query: '{query_request.query}'",
-            f"Placeholder context 2 (top_k was {query_request.top_k})",
-        ]
-        placeholder_answer = f"This is a placeholder answer for '{query_request.query}'."
-
-        response = {
-            "answer": placeholder_answer,
-            "contexts": placeholder_contexts
-        }
+        logger.debug("🔍 Processing query...")
+
+        # Layer 1: in-process LRU, then layer 2: rag_cache collection.
+        # An unreachable layer 2 is just a cache miss — generation is
+        # purely local and must not fail because the cache is down.
+        cached = True
+        response = _cache_get(cache_key)
+        if response is None:
+            try:
+                doc = await asyncio.wait_for(
+                    get_cache_collection().find_one({"_id": cache_key}),
+                    timeout=_CACHE_LOOKUP_TIMEOUT,
+                )
+            except (PyMongoError, asyncio.TimeoutError) as cache_e:
+                doc = None
+                logger.warning(f"⚠️ Cache lookup failed, generating: {repr(cache_e)}")
+            if doc is not None:
+                response = {"answer": doc["answer"], "contexts": doc["contexts"]}
+                _cache_put(cache_key, response)
+
+        if response is None:
+            cached = False
+
+            # --- RAG Model Integration ---
+            # TODO: when the real RAG model replaces these placeholders, run it
+            # via run_in_executor (or a process pool) — a synchronous model call
+            # here would block the event loop.
+            placeholder_contexts = [
+                _CTX1(q=query_request.query),
+                _CTX2(k=query_request.top_k),
+                _CTX3,
+            ]
+            placeholder_answer = _ANSWER(q=query_request.query)
+
+            response = {
+                "answer": placeholder_answer,
+                "contexts": placeholder_contexts
+            }
+
+            _cache_put(cache_key, response)
 
         # --- Log Successful Response ---
-        log_entry = {
-            "timestamp": datetime.datetime.now(datetime.timezone.utc),
-            "request_query": query_request.query,
-            "request_top_k": query_request.top_k,
-            "response_answer": response["answer"],
-            "response_contexts": response["contexts"],
-            "status": "success"
-        }
-        logger.info("💾 Storing log to MongoDB...")
-        
-        await log_collection.insert_one(log_entry)
-        logger.info("✅ Log stored successfully")
+        # Contexts are large and repetitive, so the log stores only their
+        # hash; the full text lives once in rag_contexts.
+        ctx_hash = _contexts_hash(response["contexts"])
 
-        return JSONResponse(status_code=200, content=response)
+        if not cached:
+            # Populate layer 2 and the contexts store concurrently, off
+            # the response critical path. Cache hits skip this: both
+            # writes already happened when the entry was generated.
+            _spawn_write(
+                _persist_response_artifacts(cache_key, response, ctx_hash, now)
+            )
 
-    except Exception as e:
-        error_msg = f"ERROR processing request: {str(e)}"
+        log_entry = dict(zip(_LOG_FIELDS, (
+            now,
+            query_request.query,
+            query_request.top_k,
+            response["answer"],
+            ctx_hash,
+            cached,
+            "success",
+        )))
+        _enqueue_log(log_entry)
+
+        return response
+
+    # Narrowed so driver and client-side errors fall through to the
+    # dedicated handlers instead of paying for a stack format here.
+    except RuntimeError as e:
+        exc_type = type(e).__name__
+        exc_msg = str(e)
         error_trace = traceback.format_exc()
-        logger.error(f"❌ {error_msg}")
-        logger.debug(f"Traceback:\n{error_trace}")
+        logger.exception(f"❌ ERROR processing request: {exc_msg}")
         
-        # Try to log error
+        # Queue the error log; the background flusher persists it off
+        # the response critical path.
         try:
-            if client:
-                db = client.event
-                log_collection = db.rag_logs
-                
-                error_log_data = {
-                    "timestamp": datetime.datetime.now(datetime.timezone.utc),
-                    "request_query": query_request.query,
-                    "request_top_k": query_request.top_k,
-                    "error_message": str(e),
-                    "error_type": type(e).__name__,
-                    "error_traceback": error_trace,
-                    "status": "error"
-                }
-                await log_collection.insert_one(error_log_data)
-                logger.info("💾 Error logged to database")
+            error_log_data = {
+                "timestamp": now,
+                "request_query": query_request.query,
+                "request_top_k": query_request.top_k,
+                "error_message": exc_msg,
+                "error_type": exc_type,
+                "error_traceback": error_trace,
+                "status": "error"
+            }
+            _enqueue_log(error_log_data)
         except Exception as log_e:
-            logger.error(f"❌ Failed to log error: {str(log_e)}")
+            logger.error(f"❌ Failed to queue error log: {str(log_e)}")
 
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={
                 "error": "Internal Server Error",
-                "type": type(e).__name__,
-                "message": str(e),
-                "traceback": error_trace
+                "type": exc_type,
+                "message": exc_msg
             }
         )
-    
-    finally:
-        if client:
-            client.close()
-            logger.debug("🔒 MongoDB client closed")
 
 # --- Debug endpoint ---
-@app.get("/debug/env")
-async def debug_environment():
-    """
-    Debug endpoint
-    """
-    logger.info("Debug endpoint accessed")
-    return {
+# Only registered when DEBUG=1. The payload reports presence/counts
+# only — no URI fragments or env var names, which could leak
+# credentials even on a gated endpoint.
+if DEBUG:
+    _DEBUG_INFO = {
         "mongo_uri_set": bool(MONGO_URI),
-        "mongo_uri_length": len(MONGO_URI) if MONGO_URI else 0,
-        "mongo_uri_preview": MONGO_URI[:50] + "..." if MONGO_URI and len(MONGO_URI) > 50 else MONGO_URI,
-        "python_version": os.sys.version,
+        "environment_vars_count": len(os.environ),
+        "python_version": sys.version,
     }
 
-# --- Local Development ---
+    @app.get("/debug/env")
+    async def debug_environment():
+        """
+        Debug endpoint
+        """
+        logger.info("Debug endpoint accessed")
+        return _DEBUG_INFO
+
+# --- Entrypoint ---
+def serve():
+    """
+    Run uvicorn with settings appropriate for the current environment.
+
+    ENV=production serves on all interfaces with WEB_CONCURRENCY workers
+    (defaulting to the core count), no reload and warning-level logs;
+    any other value keeps the single-worker reload setup for local
+    development. With multiple workers, the log flusher and health probe
+    run once per worker, which is the right scope for the in-memory
+    queue — and each worker opens its own Motor pool, so keep
+    MAX_POOL_SIZE * workers within the server's connection limit.
+    Equivalent gunicorn deployment:
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 main:app
+    """
+    if os.getenv("ENV") == "production":
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=int(os.getenv("PORT", "8000")),
+            workers=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+            loop="uvloop",
+            http="httptools",
+            access_log=False,
+            log_level="warning"
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host="127.0.0.1",
+            port=8000,
+            reload=True,
+            loop="uvloop",
+            http="httptools",
+            access_log=False
+        )
+
 if __name__ == "__main__":
     logger.info("--- Starting local server ---")
     if not MONGO_URI:
         logger.warning("⚠️ WARNING: MONGO_URI is not set")
-    
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+
+    serve()